@@ -1,9 +1,14 @@
+import hashlib
+import io
 import json
 import os
 import re
 import sqlite3
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import chain
 from urllib.parse import quote_plus
 
 import pandas as pd
@@ -17,17 +22,29 @@ from google.oauth2.service_account import Credentials
 # --- Constants & Config ---
 INCOME_CSV = os.path.join('data', 'zip_income_sample.csv')
 CACHE_DB = 'lead_cache.db'
+CACHE_TTL = 24 * 3600
+# Each vertical maps OSM tags to match; the optional 'elems' entry limits
+# which element types are queried (default: DEFAULT_ELEMS).
+DEFAULT_ELEMS = ('node', 'way', 'rel')
 VERTICAL_TAGS = {
     'Plumbing': {'craft': 'plumber'},
-    'Cafe': {'amenity': 'cafe'},
+    'Cafe': {'amenity': 'cafe', 'elems': ('node',)},
     'Pet Grooming': {'shop': 'pet'},
     'Medical Clinic': {'amenity': 'clinic'},
     'Specialty Retail': {'shop': 'electronics'}
 }
+ADDR_PARTS = ('addr:housenumber', 'addr:street', 'addr:city', 'addr:state')
+TAG_TO_INDUSTRY = {
+    (k, v): name
+    for name, d in VERTICAL_TAGS.items()
+    for k, v in d.items() if k != 'elems'
+}
 
 # --- Helpers & Persistence ---
+_SLUG_RE = re.compile(r'[\W_]+')
+
 def slugify(value: str) -> str:
-    return ''.join(c if c.isalnum() else '-' for c in value.lower()).strip('-')
+    return _SLUG_RE.sub('-', value.lower()).strip('-')
 
 def validate_zip(zip_code: str) -> str:
     """Return ZIP if valid else stop the app with an error."""
@@ -36,59 +53,118 @@ def validate_zip(zip_code: str) -> str:
         st.stop()
     return zip_code.strip()
 
-def init_db():
-    conn = sqlite3.connect(CACHE_DB)
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS leads (
-                    osm_id TEXT PRIMARY KEY,
-                    data TEXT
-                 )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS calls (
-                    osm_id TEXT,
-                    outcome TEXT,
-                    timestamp TEXT
-                 )""")
-    conn.commit()
-    conn.close()
-
-def save_lead(osm_id: str, data: dict):
-    conn = sqlite3.connect(CACHE_DB)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO leads(osm_id, data) VALUES(?, ?)",
-              (osm_id, json.dumps(data)))
-    conn.commit()
-    conn.close()
-
-def mark_call(osm_id: str, outcome: str):
-    conn = sqlite3.connect(CACHE_DB)
-    c = conn.cursor()
-    c.execute("INSERT INTO calls(osm_id, outcome, timestamp) VALUES(?, ?, ?)",
-              (osm_id, outcome, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
-
-def load_called_ids() -> set:
-    conn = sqlite3.connect(CACHE_DB)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT osm_id FROM calls")
-    ids = {row[0] for row in c.fetchall()}
-    conn.close()
-    return ids
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """Open the shared lead cache connection once per process."""
+    conn = sqlite3.connect(CACHE_DB, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+@st.cache_resource
+def get_db_lock() -> threading.Lock:
+    """Lock guarding the shared connection across all sessions.
+
+    Streamlit re-executes this module on every rerun, so a module-level lock
+    would be recreated per run; caching it as a resource keeps one per process.
+    """
+    return threading.Lock()
+
+def init_db(conn: sqlite3.Connection):
+    with get_db_lock():
+        c = conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS leads (
+                        osm_id TEXT PRIMARY KEY,
+                        data TEXT
+                     )""")
+        c.execute("""CREATE TABLE IF NOT EXISTS calls (
+                        osm_id TEXT,
+                        outcome TEXT,
+                        timestamp TEXT
+                     )""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_calls_osm ON calls(osm_id)")
+        c.execute("""CREATE TABLE IF NOT EXISTS cache (
+                        key TEXT PRIMARY KEY,
+                        payload BLOB,
+                        created INTEGER
+                     )""")
+
+def save_leads(conn: sqlite3.Connection, rows: list):
+    """Insert (osm_id, json) pairs in a single transaction."""
+    with get_db_lock():
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO leads(osm_id, data) VALUES(?, ?)", rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+def mark_call(conn: sqlite3.Connection, osm_id: str, outcome: str):
+    with get_db_lock():
+        conn.execute("INSERT INTO calls(osm_id, outcome, timestamp) VALUES(?, ?, ?)",
+                     (osm_id, outcome, datetime.utcnow().isoformat()))
+
+def load_called_ids(conn: sqlite3.Connection) -> set:
+    with get_db_lock():
+        rows = conn.execute("SELECT DISTINCT osm_id FROM calls").fetchall()
+    return {row[0] for row in rows}
+
+def cache_key(namespace: str, *args) -> str:
+    digest = hashlib.blake2b(json.dumps(args).encode("utf-8"), digest_size=16).hexdigest()
+    return f"{namespace}:{digest}"
+
+def cache_get(conn: sqlite3.Connection, key: str, ttl: int = CACHE_TTL):
+    """Return the cached value for key, or None if missing or expired."""
+    with get_db_lock():
+        row = conn.execute("SELECT payload FROM cache WHERE key = ? AND created >= ?",
+                           (key, int(time.time()) - ttl)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def cache_put(conn: sqlite3.Connection, key: str, value, ttl: int = CACHE_TTL):
+    """Store value under key and drop entries that have outlived ttl."""
+    now = int(time.time())
+    with get_db_lock():
+        conn.execute("DELETE FROM cache WHERE created < ?", (now - ttl,))
+        conn.execute("INSERT OR REPLACE INTO cache(key, payload, created) VALUES(?, ?, ?)",
+                     (key, json.dumps(value).encode("utf-8"), now))
+
+def cache_clear(conn: sqlite3.Connection, namespace: str):
+    """Drop every cached entry created under namespace."""
+    with get_db_lock():
+        conn.execute("DELETE FROM cache WHERE key LIKE ?", (f"{namespace}:%",))
 
+@st.cache_data(show_spinner=False)
 def load_income_data() -> pd.DataFrame:
-    df = pd.read_csv(INCOME_CSV)
-    df['zip'] = df['zip'].astype(str).str.zfill(5)
+    df = pd.read_csv(INCOME_CSV, engine='pyarrow', dtype_backend='pyarrow')
+    df['zip'] = df['zip'].astype(str).str.zfill(5).astype('category')
+    df = df.drop_duplicates('zip').set_index('zip')
+    df['median_income'] = pd.to_numeric(df['median_income'], downcast='unsigned')
+    df['tier'] = pd.cut(
+        df['median_income'],
+        [float('-inf'), 60000, 80000, float('inf')],
+        labels=['Low', 'Medium', 'High'],
+        right=False
+    ).fillna('Low')
     return df
 
 # --- Geocoding & Caching ---
-@st.cache_data(show_spinner=False, ttl=24*3600)
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
 def geocode_zip(zip_code: str):
+    conn = get_conn()
+    key = cache_key("geocode", zip_code)
+    cached = cache_get(conn, key)
+    if cached is not None:
+        return tuple(cached)
     geolocator = Nominatim(user_agent="streamlit-lead-app")
     query = f"{zip_code}, USA"
     for _ in range(3):
         try:
             loc = geolocator.geocode(query, timeout=10)
             if loc:
+                cache_put(conn, key, [loc.latitude, loc.longitude])
                 return loc.latitude, loc.longitude
         except (GeocoderTimedOut, GeocoderUnavailable):
             time.sleep(1)
@@ -96,49 +172,79 @@ def geocode_zip(zip_code: str):
     st.stop()
 
 # --- Overpass Query & Caching ---
-@st.cache_data(show_spinner=False, ttl=24*3600)
+def element_record(el) -> dict:
+    """Reduce an overpy element to the fields the lead loop needs."""
+    if isinstance(el, overpy.Node):
+        lat, lon = el.lat, el.lon
+    else:
+        lat, lon = el.center_lat, el.center_lon
+    return {
+        'id': el.id,
+        'tags': el.tags,
+        'lat': float(lat) if lat is not None else None,
+        'lon': float(lon) if lon is not None else None
+    }
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
 def overpass_query(lat: float, lon: float, radius: int, verticals: list, days: int):
+    conn = get_conn()
+    tag_config = [VERTICAL_TAGS[name] for name in verticals]
+    key = cache_key("overpass", lat, lon, radius, verticals, tag_config, DEFAULT_ELEMS, days)
+    cached = cache_get(conn, key)
+    if cached is not None:
+        return cached
     api = overpy.Overpass()
     date_limit = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d")
-    parts = []
+    values_by_filter = {}
     for name in verticals:
         tags = VERTICAL_TAGS[name]
+        elems = tags.get('elems', DEFAULT_ELEMS)
         for k, v in tags.items():
-            for elem in ("node", "way"):
-                for date_tag in ("opening_date", "start_date"):
-                    parts.append(
-                        f'  {elem}[{k}="{v}"](around:{radius*1609},{lat},{lon})["{date_tag}" > "{date_limit}"];'
-                    )
+            if k == 'elems':
+                continue
+            for elem in elems:
+                values_by_filter.setdefault((k, elem), []).append(v)
+    around = f"(around:{radius*1609},{lat},{lon})"
+    parts = []
+    for (k, elem), values in values_by_filter.items():
+        pattern = "|".join(dict.fromkeys(values))
+        parts.append(f'  {elem}["{k}"~"^({pattern})$"]{around};')
     combined = "\n".join(parts)
     query = f"""
 [out:json][timeout:25];
 (
 {combined}
 );
+nwr._[~"^(opening_date|start_date)$"~"."]
+  (if: t["opening_date"] > "{date_limit}" || t["start_date"] > "{date_limit}");
 out center;
 """
     try:
-        return api.query(query)
+        result = api.query(query)
     except overpy.exception.OverpassBadRequest:
         st.error("⚠️ Overpass query failed. Try a wider radius or shorter date range.")
         st.stop()
+    elements = [
+        element_record(el)
+        for el in chain(result.nodes, result.ways, result.relations)
+    ]
+    cache_put(conn, key, elements)
+    return elements
 
 # --- Lead Scoring ---
-def compute_lead_score(row) -> int:
-    score = max(0, 30 - row['newness_days'])
-    if row['phone']:
-        score += 10
-    if row['email/social']:
-        score += 5
-    if row['income_tier'] == 'High':
-        score += 10
-    elif row['income_tier'] == 'Medium':
-        score += 5
-    return score
+def compute_lead_scores(df: pd.DataFrame) -> pd.Series:
+    """Score every lead in one vectorized pass."""
+    return (
+        (30 - df['newness_days']).clip(lower=0)
+        + df['phone'].astype(bool) * 10
+        + (df['email/social'] != '').astype(int) * 5
+        + df['income_tier'].map({'High': 10, 'Medium': 5}).fillna(0).astype(int)
+    )
 
 # --- Main App ---
 def main():
-    init_db()
+    conn = get_conn()
+    init_db(conn)
     st.title("Local Lead Generator")
 
     # Sidebar controls
@@ -152,62 +258,68 @@ def main():
         )
         days = st.slider("New within N days", 1, 30, 14)
         if st.button("Refresh Leads"):
-            st.cache_data.clear()
+            overpass_query.clear()
+            cache_clear(conn, "overpass")
 
-    # Geocode & display map
     zip_code = validate_zip(zip_input)
-    lat, lon = geocode_zip(zip_code)
-    st.map(pd.DataFrame({"lat": [lat], "lon": [lon]}))
 
-    # Fetch POIs and process
-    result = overpass_query(lat, lon, radius, verticals, days)
-    income_df = load_income_data()
-    called_ids = load_called_ids()
+    # Local lookups run in the background while the network calls below
+    # stay on the script thread, where st.error/st.stop are valid.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        income_future = pool.submit(load_income_data)
+        called_future = pool.submit(load_called_ids, conn)
+
+        # Geocode & display map
+        lat, lon = geocode_zip(zip_code)
+        st.map(pd.DataFrame({"lat": [lat], "lon": [lon]}))
 
+        # Fetch POIs and process
+        elements = overpass_query(lat, lon, radius, verticals, days)
+        income_df = income_future.result()
+        called_ids = called_future.result()
+
+    candidates = [
+        el for el in elements
+        if 'website' not in el['tags']
+        and (el['tags'].get('phone') or el['tags'].get('contact:phone'))
+        and (el['tags'].get('opening_date') or el['tags'].get('start_date'))
+        and str(el['id']) not in called_ids
+    ]
+
+    now = datetime.utcnow()
     leads = []
-    elements = list(result.nodes) + list(result.ways)
-    for el in elements:
-        tags = el.tags
-        if 'website' in tags:
-            continue
+    for el in candidates:
+        tags = el['tags']
         phone = tags.get('phone') or tags.get('contact:phone')
-        if not phone:
-            continue
         opening = tags.get('opening_date') or tags.get('start_date')
-        if not opening:
-            continue
         try:
-            newness = (datetime.utcnow() - datetime.fromisoformat(opening)).days
+            newness = (now - datetime.fromisoformat(opening[:10])).days
         except Exception:
             continue
-        if str(el.id) in called_ids:
-            continue
 
         zip_lookup = tags.get('addr:postcode', '')
-        inc_row = income_df[income_df['zip'] == zip_lookup]
-        if not inc_row.empty:
-            inc = inc_row.iloc[0]['median_income']
-            tier = 'High' if inc >= 80000 else 'Medium' if inc >= 60000 else 'Low'
-        else:
+        try:
+            tier = income_df.at[zip_lookup, 'tier']
+        except KeyError:
             tier = 'Unknown'
 
         email = tags.get('email') or tags.get('contact:email')
         social = tags.get('contact:facebook') or tags.get('contact:instagram')
         name = tags.get('name', 'Unknown')
         industry = next(
-            (k for k, v in VERTICAL_TAGS.items()
-             if all(tags.get(tk) == tv for tk, tv in v.items())),
+            (TAG_TO_INDUSTRY[(k, v)] for k, v in tags.items() if (k, v) in TAG_TO_INDUSTRY),
             'Other'
         )
         slug = slugify(name)
         demo_link = f"https://yourdomain.com/demo/{slug}"
 
-        addr = tags.get('addr:full') or ' '.join(
-            filter(None, [tags.get('addr:housenumber'), tags.get('addr:street'), tags.get('addr:city'), tags.get('addr:state')])
-        )
+        if not (addr := tags.get('addr:full')):
+            addr = ' '.join(
+                v for v in (tags.get(k) for k in ADDR_PARTS) if v
+            )
 
         row = {
-            'osm_id': str(el.id),
+            'osm_id': str(el['id']),
             'name': name,
             'industry': industry,
             'address': addr,
@@ -217,9 +329,7 @@ def main():
             'income_tier': tier,
             'demo_link': demo_link
         }
-        row['lead_score'] = compute_lead_score(row)
         leads.append(row)
-        save_lead(str(el.id), row)
 
     df = pd.DataFrame(leads)
 
@@ -227,6 +337,9 @@ def main():
         st.info("No leads found.")
         return
 
+    df['lead_score'] = compute_lead_scores(df)
+    save_leads(conn, [(r['osm_id'], json.dumps(r)) for r in df.to_dict('records')])
+
     if st.checkbox("Show only High Income ZIPs"):
         df = df[df['income_tier'] == 'High']
 
@@ -235,24 +348,25 @@ def main():
     edited = st.data_editor(df, num_rows="dynamic")
 
     # Call & log
-    for _, row in edited.iterrows():
-        st.markdown(f"**{row['name']}**")
-        st.write(f"📞 [Call](tel:{quote_plus(row['phone'])})")
-        outcome = st.selectbox(
-            "Outcome",
-            ["Uncalled", "Connected", "Voicemail", "No Answer"],
-            key=f"outcome_{row['osm_id']}"
-        )
-        if outcome != "Uncalled":
-            mark_call(row['osm_id'], outcome)
-        st.write(f"[Demo Link]({row['demo_link']})")
-        st.write("---")
+    for row in edited.to_dict('records'):
+        with st.form(f"row_{row['osm_id']}"):
+            st.markdown(f"**{row['name']}**")
+            st.write(f"📞 [Call](tel:{quote_plus(row['phone'])})")
+            outcome = st.selectbox(
+                "Outcome",
+                ["Uncalled", "Connected", "Voicemail", "No Answer"],
+                key=f"outcome_{row['osm_id']}"
+            )
+            st.write(f"[Demo Link]({row['demo_link']})")
+            if st.form_submit_button("Log Outcome") and outcome != "Uncalled":
+                mark_call(conn, row['osm_id'], outcome)
 
     # Export & SMS
     col1, col2 = st.columns(2)
     with col1:
-        csv_data = df.to_csv(index=False).encode("utf-8")
-        st.download_button("Export to CSV", csv_data, "leads.csv", "text/csv")
+        csv_buf = io.BytesIO()
+        df.to_csv(csv_buf, index=False, encoding="utf-8")
+        st.download_button("Export to CSV", csv_buf.getvalue(), "leads.csv", "text/csv")
         if st.button("Export to Google Sheets"):
             try:
                 info = st.secrets.get("gcp_service_account")